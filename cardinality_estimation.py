@@ -54,7 +54,7 @@ class HyperLogLog(object):
         :param data: the data added to hyperloglog structure
         """
         leftmost = lambda bits: self.hash_bit_size - self.b - bits.bit_length() + 1
-        data = int(self.hash_func(str(hash(data))).hexdigest, 16) & ((1 << self.hash_bit_size) - 1)
+        data = int(self.hash_func(str(hash(data)).encode()).hexdigest(), 16) & ((1 << self.hash_bit_size) - 1)
         index = data & (self.m - 1)
         new_result = leftmost(data >> self.b)
         assert new_result > 0, 'Hash value overflow.'
@@ -0,0 +1,102 @@
+"""
+Derive a smaller model from a trained one by folding its sketch, without retraining.
+"""
+import argparse
+import pickle
+import logging
+
+
+def load_model(filepath):
+    """
+    Helper function for loading a trained language model.
+
+    filepath: str
+        the location of the model
+
+    Returns: dict
+        the pickled model, see train.save_model
+    """
+    with open(filepath, 'rb') as fin:
+        return pickle.load(fin)
+
+
+def main():
+    model = load_model(args.model)
+    counter = model['counter']
+
+    if model['type'] == 'naive':
+        raise ValueError('only sketch models can be folded')
+
+    error, relative_error, delta = counter.expected_error()
+    logging.info('original: hash_size = %d, hash_num = %d, %d bytes, '
+                 'error <= %.2f + %.1f%% of the count w.p. %g'
+                 % (counter.hash_size, counter.hash_num, counter.counters.nbytes,
+                    error, relative_error * 100, delta))
+
+    if args.memory_budget is not None:
+        folded = counter.shrink(int(args.memory_budget * 1024 * 1024),
+                                min_hash_num=args.min_hash_num)
+    else:
+        folded = counter.fold(hash_size=args.hash_size, hash_num=args.hash_num)
+
+    error, relative_error, delta = folded.expected_error()
+    logging.info('folded: hash_size = %d, hash_num = %d, %d bytes, '
+                 'error <= %.2f + %.1f%% of the count w.p. %g'
+                 % (folded.hash_size, folded.hash_num, folded.counters.nbytes,
+                    error, relative_error * 100, delta))
+
+    model.update({
+        'counter': folded,
+        'hash_size': folded.hash_size,
+        'hash_num': folded.hash_num,
+    })
+    if model.get('sizing'):
+        model['sizing'] = dict(model['sizing'], hash_size=folded.hash_size,
+                               hash_num=folded.hash_num, predicted_error=float(error),
+                               delta=float(delta), limit='fold')
+    with open(args.output, 'wb') as fout:
+        pickle.dump(model, fout)
+    logging.info('model saved to %s' % args.output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('model',
+                        type=str,
+                        help='the trained language model'
+                        )
+    parser.add_argument('output',
+                        type=str,
+                        help='location to save the folded model'
+                        )
+    parser.add_argument('-m', '--memory_budget',
+                        type=float,
+                        help='memory available for the counters (in MiB), overrides --hash_size and --hash_num'
+                        )
+    parser.add_argument('-hn', '--hash_num',
+                        type=int,
+                        help='the number of hash functions to keep (default: all)'
+                        )
+    parser.add_argument('-hs', '--hash_size',
+                        type=int,
+                        help='the new size of the hash values, must divide the current one (default: unchanged)'
+                        )
+    parser.add_argument('--min_hash_num',
+                        type=int,
+                        default=4,
+                        help='the least number of hash functions to keep under --memory_budget (default: 4)'
+                        )
+    parser.add_argument('-v', '--verbose',
+                        help='increase verbosity',
+                        action='store_const',
+                        dest='loglevel',
+                        const=logging.INFO,
+                        default=logging.WARNING
+                        )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.loglevel,
+                        format='%(asctime)s: %(levelname)s: %(message)s')
+
+    main()
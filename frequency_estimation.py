@@ -4,6 +4,7 @@ The file contains strategies for frequency estimation, including Count Sketch, C
 Programmer: Hugo Zhang
 Date: 2018/8/13
 """
+import copy
 import hashlib
 import numpy as np
 from collections import Counter
@@ -15,10 +16,11 @@ class Sketch(object):
     Contains two functions: process, query(can be used by [] operator).
     """
 
-    def __init__(self, hash_size, hash_num):
+    def __init__(self, hash_size, hash_num, dtype=int):
         """
         :param hash_size: the size of hash table, 2/epsilon (or 3/squared epsilon)
         :param hash_num: the amount of hash tables, O(log(1/delta))
+        :param dtype: the type of the counters, wide enough for the total count
         """
         assert isinstance(hash_size, int) and hash_size > 0, \
             'The size of hash table should be positive integer.'
@@ -27,7 +29,7 @@ class Sketch(object):
 
         self.hash_size = hash_size
         self.hash_num = hash_num
-        self.counters = np.zeros((hash_num, hash_size), dtype=int)
+        self.counters = np.zeros((hash_num, hash_size), dtype=dtype)
 
     def myhash(self, x, hash_func=hash):
         """
@@ -51,6 +53,23 @@ class Sketch(object):
         """
         pass
 
+    def batch_hash(self, xs):
+        """
+        :param xs: list of elements to be hashed
+        :return: array of shape (len(xs), hash_num), the hash values that myhash reduces
+                 modulo hash_size
+        """
+        suffixes = [str(i) for i in range(self.hash_num)]
+        return np.array([hash(x + i) for x in map(str, xs) for i in suffixes],
+                        dtype=np.int64).reshape(len(xs), self.hash_num)
+
+    def process_batch(self, counts):
+        """
+        :param counts: dict from elements to be counted to their addends
+        """
+        for x, c in counts.items():
+            self.process(x, c)
+
     def query(self, x):
         """
         :param x: the element to be counted
@@ -58,6 +77,80 @@ class Sketch(object):
         """
         pass
 
+    def error_bound(self):
+        """
+        :return: (epsilon, delta), the estimate is off by more than epsilon * norm
+                 with probability at most delta
+        """
+        pass
+
+    def norm(self):
+        """
+        :return: the stream norm that epsilon is relative to
+        """
+        pass
+
+    def relative_error(self):
+        """
+        :return: the deviation of the estimate that grows with the count itself, as a fraction
+                 of the count
+        """
+        return 0.
+
+    def expected_error(self):
+        """
+        :return: (additive error, relative error, failure probability) of a single query, the
+                 estimate is off by at most additive error + relative error * count
+        """
+        epsilon, delta = self.error_bound()
+        return epsilon * self.norm(), self.relative_error(), delta
+
+    def fold(self, hash_size=None, hash_num=None):
+        """
+        Derive a smaller sketch without rescanning the corpus. Since an element lands in
+        column (h % hash_size), folding to a width that divides hash_size simply sums the
+        columns that collide at the new width, and dropping rows drops hash functions.
+        The result equals a sketch trained directly with the new sizes.
+        :param hash_size: the new size of hash table, must divide the current one
+        :param hash_num: the new amount of hash tables, at most the current one
+        :return: a new sketch of the same type, self is left untouched
+        """
+        hash_size = self.hash_size if hash_size is None else hash_size
+        hash_num = self.hash_num if hash_num is None else hash_num
+        assert isinstance(hash_size, int) and 0 < hash_size <= self.hash_size \
+            and self.hash_size % hash_size == 0, \
+            'The new size of hash table should divide the current one.'
+        assert isinstance(hash_num, int) and 0 < hash_num <= self.hash_num, \
+            'The new amount of hash tables should not exceed the current one.'
+
+        folded = copy.copy(self)
+        folded.hash_size = hash_size
+        folded.hash_num = hash_num
+        folded.counters = self.counters[..., :hash_num, :].reshape(
+            self.counters.shape[:-2] + (hash_num, -1, hash_size)).sum(
+            axis=-2, dtype=self.counters.dtype)
+        return folded
+
+    def shrink(self, memory_budget, min_hash_num=4):
+        """
+        Fold the sketch so that its counters fit in the given memory. Width is kept as
+        large as possible since it drives epsilon, rows are dropped first down to
+        min_hash_num since each of them only buys a constant factor of delta.
+        :param memory_budget: the memory available for counters, in bytes
+        :param min_hash_num: the least amount of hash tables to keep
+        :return: a new sketch of the same type
+        """
+        cell_bytes = self.counters.nbytes // (self.hash_num * self.hash_size)
+        min_hash_num = min(min_hash_num, self.hash_num)
+        hash_size = self.hash_size
+        while True:
+            hash_num = min(self.hash_num, memory_budget // (hash_size * cell_bytes))
+            if hash_num >= min_hash_num:
+                return self.fold(hash_size, int(hash_num))
+            assert hash_size % 2 == 0, \
+                'Cannot fit the sketch in %d bytes by folding.' % memory_budget
+            hash_size //= 2
+
     def __getitem__(self, x):
         """
         [] operator implement for query
@@ -82,14 +175,17 @@ class Simple(Sketch):
     def process(self, x, c=1):
         self.counters[x] += c
 
+    def process_batch(self, counts):
+        self.counters.update(counts)
+
     def query(self, x):
         return self.counters[x]
 
 
 class CountSketch(Sketch):
 
-    def __init__(self, hash_size, hash_num):
-        super().__init__(hash_size, hash_num)
+    def __init__(self, hash_size, hash_num, dtype=int):
+        super().__init__(hash_size, hash_num, dtype)
 
     def __iadd__(self, other):
         self.counters += other.counters
@@ -111,16 +207,32 @@ class CountSketch(Sketch):
         for row, h1, h2 in zip(self.counters, self.myhash(x), self.myhash2(x)):
             row[h1] += (c * h2)
 
+    def process_batch(self, counts):
+        if not counts:
+            return
+        hashes = self.batch_hash(list(counts))
+        weights = np.fromiter(counts.values(), dtype=self.counters.dtype, count=len(counts))
+        rows = np.broadcast_to(np.arange(self.hash_num), hashes.shape)
+        np.add.at(self.counters, (rows, hashes % self.hash_size),
+                  weights[:, None] * (hashes % 2 * 2 - 1))
+
     def query(self, x):
         result = [h2 * row[h1] for row, h1,
                   h2 in zip(self.counters, self.myhash(x), self.myhash2(x))]
         return np.median(result)
 
+    def error_bound(self):
+        return np.sqrt(3 / self.hash_size), np.exp(-self.hash_num / 8)
+
+    def norm(self):
+        # every row is an AMS sketch of the stream, its squared sum estimates F2
+        return np.sqrt(np.median(np.sum(self.counters.astype(np.float64) ** 2, axis=1)))
+
 
 class CountMinSketch(Sketch):
 
-    def __init__(self, hash_size, hash_num):
-        super().__init__(hash_size, hash_num)
+    def __init__(self, hash_size, hash_num, dtype=int):
+        super().__init__(hash_size, hash_num, dtype)
 
     def __iadd__(self, other):
         self.counters += other.counters
@@ -132,5 +244,169 @@ class CountMinSketch(Sketch):
         for row, h in zip(self.counters, self.myhash(x)):
             row[h] += c
 
+    def process_batch(self, counts):
+        self._process_batch(self.counters, counts)
+
+    def _process_batch(self, counters, counts):
+        """
+        :param counters: the counter matrix to update
+        :param counts: dict from elements to be counted to their addends
+        """
+        if not counts:
+            return
+        indices = self.batch_hash(list(counts)) % self.hash_size
+        weights = np.fromiter(counts.values(), dtype=counters.dtype, count=len(counts))
+        rows = np.broadcast_to(np.arange(self.hash_num), indices.shape)
+        np.add.at(counters, (rows, indices), weights[:, None])
+
     def query(self, x):
         return min(row[h] for row, h in zip(self.counters, self.myhash(x)))
+
+    def error_bound(self):
+        return np.e / self.hash_size, np.exp(-self.hash_num)
+
+    def norm(self):
+        # every row adds up to the total count of the stream
+        return int(self.counters[0].sum())
+
+
+
+class WindowedCountMinSketch(CountMinSketch):
+    """
+    Count-Min Sketch over a sliding window of the stream.
+    The counters are a ring of window_num sub-sketches, new elements go to the current one and
+    rotate() expires the oldest one, so counters stay bounded by the volume of the window.
+    Queries take the minimum over the summed rows, i.e. a Count-Min Sketch of the window.
+    """
+
+    def __init__(self, hash_size, hash_num, window_num):
+        """
+        :param window_num: the amount of sub-sketches kept in the window
+        """
+        super().__init__(hash_size, hash_num)
+        assert isinstance(window_num, int) and window_num > 0, \
+            'The amount of sub-sketches should be positive integer.'
+
+        self.window_num = window_num
+        self.current = 0
+        self.counters = np.zeros((window_num, hash_num, hash_size), dtype=int)
+
+    def __iadd__(self, other):
+        assert self.window_num == other.window_num and self.current == other.current, \
+            'Windows not aligned.'
+        self.counters += other.counters
+        return self
+
+    def rotate(self):
+        """
+        Start a new sub-sketch in place of the oldest one.
+        """
+        self.current = (self.current + 1) % self.window_num
+        self.counters[self.current] = 0
+
+    def process(self, x, c=1):
+        assert isinstance(c, int) and c > 0, \
+            'The times of occurrence should be positive integer.'
+        for row, h in zip(self.counters[self.current], self.myhash(x)):
+            row[h] += c
+
+    def process_batch(self, counts):
+        self._process_batch(self.counters[self.current], counts)
+
+    def query(self, x):
+        return min(self.counters[:, i, h].sum() for i, h in enumerate(self.myhash(x)))
+
+    def norm(self):
+        return int(self.counters[:, 0].sum())
+
+
+class MorrisCountMinSketch(CountMinSketch):
+    """
+    Count-Min Sketch whose cells are 8-bit Morris counters.
+    A cell at level v stands for (base^v - 1) / (base - 1) occurrences and moves to level v + 1
+    with probability base^-v, so a byte covers counts up to about 5e6 with base 1.05 (larger
+    counts saturate) at a relative standard deviation of sqrt((base - 1) / 2).
+    Updates are conservative as in Count-Min-Log: a single coin is flipped at the lowest level of
+    the element's cells and only the cells at that level move up. The lowest cell then behaves as
+    one Morris counter of the element, which the minimum in query does not bias downwards, while
+    collisions can only raise it.
+    """
+
+    max_level = np.iinfo(np.uint8).max
+
+    def __init__(self, hash_size, hash_num, base=1.05, seed=0):
+        """
+        :param base: the base of the log counters, larger base trades accuracy for range
+        :param seed: seed of the random number generator deciding the increments
+        """
+        super().__init__(hash_size, hash_num)
+        assert base > 1, 'The base of the counters should be greater than 1.'
+
+        self.base = base
+        self.random_state = np.random.RandomState(seed)
+        self.counters = np.zeros((hash_num, hash_size), dtype=np.uint8)
+
+    def __iadd__(self, other):
+        assert self.base == other.base, 'Counter bases not the same.'
+        self.counters = self._encode(
+            self._decode(self.counters) + self._decode(other.counters))
+        return self
+
+    def _decode(self, levels):
+        """
+        :param levels: array of counter levels
+        :return: the estimated counts
+        """
+        return (self.base ** levels.astype(np.float64) - 1) / (self.base - 1)
+
+    def _encode(self, counts):
+        """
+        :param counts: array of counts
+        :return: the counter levels, randomly rounded so that they decode to counts on average
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        levels = np.floor(np.log1p(counts * (self.base - 1)) / np.log(self.base))
+        levels = np.minimum(levels, self.max_level)
+        low, high = self._decode(levels), self._decode(levels + 1)
+        levels += (self.random_state.random_sample(counts.shape) * (high - low) < counts - low) \
+            & (levels < self.max_level)
+        return levels.astype(np.uint8)
+
+    def process(self, x, c=1):
+        assert isinstance(c, int) and c > 0, \
+            'The times of occurrence should be positive integer.'
+        cells = (np.arange(self.hash_num),
+                 np.fromiter(self.myhash(x), dtype=np.int64, count=self.hash_num))
+        levels = self.counters[cells]
+        left = c
+        while True:
+            level = int(levels.min())
+            if level >= self.max_level:
+                break
+            # skip over the failed increments, which are geometrically distributed
+            left -= self.random_state.geometric(self.base ** -level)
+            if left < 0:
+                break
+            levels[levels == level] += 1
+        self.counters[cells] = levels
+
+    # every increment draws from the random state, so there is nothing to vectorize
+    process_batch = Sketch.process_batch
+
+    def query(self, x):
+        return self._decode(super().query(x))
+
+    def relative_error(self):
+        # standard deviation of a Morris counter
+        return np.sqrt((self.base - 1) / 2)
+
+    def norm(self):
+        return float(self._decode(self.counters[0]).sum())
+
+    def fold(self, hash_size=None, hash_num=None):
+        # log counters cannot be summed directly, fold the estimated counts instead
+        decoded = copy.copy(self)
+        decoded.counters = self._decode(self.counters)
+        folded = super(MorrisCountMinSketch, decoded).fold(hash_size, hash_num)
+        folded.counters = self._encode(folded.counters)
+        return folded
@@ -0,0 +1,98 @@
+"""
+Compare the error of Count-Min Sketch with int64 and 8-bit Morris cells at the same memory,
+using accurate counting as the ground truth. Errors are reported over all distinct ngrams,
+which singletons dominate, and over the most frequent ngrams, where a bias would show.
+"""
+import argparse
+import logging
+import numpy as np
+from train import CorpusReader
+import frequency_estimation
+
+
+def relative_errors(counter, truth):
+    """
+    Helper function for measuring the error of a counter.
+
+    counter: frequency_estimation.Sketch object
+    truth: frequency_estimation.Simple object
+
+    Returns: np.ndarray
+        (estimate - count) / count of every distinct ngram, most frequent ngrams first
+    """
+    ngrams = [ngram for ngram, _ in truth.counters.most_common()]
+    counts = np.array([truth[ngram] for ngram in ngrams], dtype=np.float64)
+    estimates = np.array([counter[ngram] for ngram in ngrams], dtype=np.float64)
+    return (estimates - counts) / counts
+
+
+def main():
+    memory_budget = args.hash_size * args.hash_num * np.dtype(int).itemsize
+    counters = {
+        'count_min_sketch': frequency_estimation.CountMinSketch(
+            hash_num=args.hash_num, hash_size=args.hash_size),
+    }
+    for base in args.morris_base:
+        counters['morris_count_min_sketch(base=%g)' % base] = \
+            frequency_estimation.MorrisCountMinSketch(
+                hash_num=args.hash_num, hash_size=args.hash_size * 8, base=base)
+    truth = frequency_estimation.Simple()
+
+    reader = CorpusReader(args.infile, ngram_size=args.ngram_size)
+    for ngram in reader:
+        truth.process(ngram)
+        for counter in counters.values():
+            counter.process(ngram)
+
+    print('%d ngrams, %d distinct, %d bytes per sketch'
+          % (sum(truth.counters.values()), len(truth.counters), memory_budget))
+    print('%-36s %10s %10s %10s %10s %10s %10s'
+          % ('model', 'bytes', 'mean', 'median', 'p99',
+             'top%d bias' % args.top_k, 'top%d mean' % args.top_k))
+    for name, counter in counters.items():
+        errors = relative_errors(counter, truth)
+        top = errors[:args.top_k]
+        errors = np.abs(errors)
+        print('%-36s %10d %10.4f %10.4f %10.4f %+10.4f %10.4f'
+              % (name, counter.counters.nbytes, errors.mean(), np.median(errors),
+                 np.percentile(errors, 99), top.mean(), np.abs(top).mean()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('infile',
+                        help='the corpus file used to train the models'
+                        )
+    parser.add_argument('-hn', '--hash_num',
+                        type=int,
+                        default=4,
+                        help='the number of hash functions to use (default: 4)'
+                        )
+    parser.add_argument('-hs', '--hash_size',
+                        type=int,
+                        default=4096,
+                        help='the size of the hash values of the int64 sketch, the 8-bit sketch is 8 times wider (default: 4096)'
+                        )
+    parser.add_argument('-ns', '--ngram_size',
+                        type=int,
+                        default=3,
+                        help='ngrams of size ngram_size - 1 and ngram_size will be counted (default: 3)'
+                        )
+    parser.add_argument('-b', '--morris_base',
+                        type=float,
+                        nargs='+',
+                        default=[1.02, 1.05],
+                        help='the bases of the 8-bit log counters to compare (default: 1.02 1.05)'
+                        )
+    parser.add_argument('-k', '--top_k',
+                        type=int,
+                        default=300,
+                        help='the number of most frequent ngrams to report separately (default: 300)'
+                        )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s: %(levelname)s: %(message)s')
+
+    main()
@@ -10,10 +10,16 @@ import argparse
 import pickle
 import itertools
 import logging
+import time
 from multiprocessing import Process, Manager, cpu_count
-from train import tokenize, save_model
+from train import tokenize, save_model, auto_size, check_overflow
 import frequency_estimation
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 
 def line_reader(line, ngram_size, vocabulary):
     # tokenize
@@ -32,7 +38,11 @@ def line_reader(line, ngram_size, vocabulary):
         yield tuple(words[offset:offset + ngram_size - 1])
 
 
-def get_model(args):
+def get_model(args, seed=0):
+    """
+    seed: int, optional (default: 0)
+        seed of the random increments of --morris, every worker needs a different one
+    """
     # choose the counting method base on args
     if args.accurate:
         counter = frequency_estimation.Simple()
@@ -41,41 +51,102 @@ def get_model(args):
         counter = frequency_estimation.CountSketch(
             hash_num=args.hash_num, hash_size=args.hash_size)
         model_type = 'count_sketch'
+    elif args.morris:
+        counter = frequency_estimation.MorrisCountMinSketch(
+            hash_num=args.hash_num, hash_size=args.hash_size, base=args.morris_base,
+            seed=seed)
+        model_type = 'morris_count_min_sketch'
     else:
         counter = frequency_estimation.CountMinSketch(
-            hash_num=args.hash_num, hash_size=args.hash_size)
+            hash_num=args.hash_num, hash_size=args.hash_size,
+            dtype=args.sizing['dtype'] if args.sizing else int)
         model_type = 'count_min_sketch'
 
     return counter, model_type
 
 
+def peak_memory():
+    """
+    Returns: int
+        peak resident memory of the current process in KiB, or 0 if it cannot be measured.
+        It is a high-water mark over the lifetime of the process, and a forked process starts
+        from the resident memory of its parent, so compare it to a value taken earlier.
+    """
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
 def worker(pid, in_queue, out_list, args):
-    counter, model_type = get_model(args)
+    baseline = peak_memory()
+    counter, model_type = get_model(args, seed=pid)
+
+    # seconds spent on each phase, reported along with the counter
+    stats = {'pid': pid, 'lines': 0, 'ngrams': 0, 'wait': 0., 'tokenize': 0., 'count': 0.}
 
     vocabulary = set()
     while True:
+        start = time.perf_counter()
         line = in_queue.get(block=True)
+        stats['wait'] += time.perf_counter() - start
 
         if line is None:
-            out_list.append((counter, vocabulary))
+            stats['peak_memory_growth'] = peak_memory() - baseline
+            out_list.append((counter, vocabulary, stats))
             return
 
-        for ngram in line_reader(line, args.ngram_size, vocabulary):
+        start = time.perf_counter()
+        ngrams = list(line_reader(line, args.ngram_size, vocabulary))
+        stats['tokenize'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for ngram in ngrams:
             counter.process(ngram)
+        stats['count'] += time.perf_counter() - start
+        stats['lines'] += 1
+        stats['ngrams'] += len(ngrams)
 
 
 def merge_and_save_model(worker_results, args):
-    # save the model for future evaluation
-    merged_counter, model_type = get_model(args)
+    """
+    Merge the counters of all workers and save the model.
+
+    worker_results: list[(frequency_estimation.Sketch object, set, dict)]
+    args: argparse.Namespace
+
+    Returns: dict
+        seconds spent on merging and saving
+    """
+    start = time.perf_counter()
+    merged_counter, model_type = get_model(args, seed=args.process)
     merged_vocab = set()
-    for counter, vocab in worker_results:
+    for counter, vocab, _ in worker_results:
         merged_counter += counter
         merged_vocab |= vocab
+    merged = time.perf_counter()
+    if args.sizing:
+        check_overflow(merged_counter, sum(stats['ngrams'] for _, _, stats in worker_results))
+
+    # save the model for future evaluation
     save_model(merged_counter, model_type, len(
         merged_vocab), args.output, args)
+    return {'merge': merged - start, 'save': time.perf_counter() - merged}
+
 
+def main(args):
+    """
+    Train a model with args.process workers.
+
+    Returns: dict
+        seconds spent on each phase of the main process, its peak memory growth in KiB (only
+        meaningful if nothing before it in the process used more memory, see peak_memory) and
+        the stats of every worker
+    """
+    baseline = peak_memory()
+    args.sizing = None
+    if args.memory_budget is not None or args.target_error is not None:
+        auto_size(args)
 
-def main():
     mangaer = Manager()
     results = mangaer.list()
     work = mangaer.Queue(args.process)
@@ -86,20 +157,48 @@ def main():
         p.start()
         pool.append(p)
 
+    # read: reading lines from the file, feed: waiting for room in the queue, i.e. for the
+    # workers to catch up
+    read, feed = 0., 0.
     with open(args.infile, 'r', encoding=args.encoding) as fin:
         lines = itertools.chain(fin, (None,) * args.process)
-        for i, line in enumerate(lines):
+        for i in itertools.count():
+            start = time.perf_counter()
+            line = next(lines, StopIteration)
+            read += time.perf_counter() - start
+            if line is StopIteration:
+                break
+
+            start = time.perf_counter()
             work.put(line)
+            feed += time.perf_counter() - start
             if (i + 1) % 100 == 0:
                 logging.info('processed %d lines' % (i + 1))
                 # merge_and_save_model(results, args)
 
+    start = time.perf_counter()
     for p in pool:
         p.join()
+    join = time.perf_counter() - start
+
+    # fetch the worker results from the manager only once, every access unpickles them
+    start = time.perf_counter()
+    results = list(results)
+    transfer = time.perf_counter() - start
 
-    merge_and_save_model(results, args)
+    stats = merge_and_save_model(results, args)
     logging.info('model saved to %s' % args.output)
 
+    stats.update({
+        'read': read,
+        'feed': feed,
+        'join': join,
+        'transfer': transfer,
+        'peak_memory_growth': peak_memory() - baseline,
+        'workers': sorted((s for _, _, s in results), key=lambda s: s['pid']),
+    })
+    return stats
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
@@ -131,11 +230,34 @@ if __name__ == '__main__':
                         default=65536,
                         help='the size of the hash values'
                         )
+    parser.add_argument('-m', '--memory_budget',
+                        type=float,
+                        help='choose hash_size, hash_num and the counter type to fit the sketch in the given memory (in MiB)'
+                        )
+    parser.add_argument('-e', '--target_error',
+                        type=float,
+                        help='choose hash_size, hash_num and the counter type to keep the overestimate of a count under the given error'
+                        )
+    parser.add_argument('--delta',
+                        type=float,
+                        default=0.001,
+                        help='the probability that a count misses the target error under --memory_budget or --target_error (default: 0.001)'
+                        )
+    parser.add_argument('--sample_fraction',
+                        type=float,
+                        default=0.01,
+                        help='the fraction of the corpus scanned to size the sketch (default: 0.01)'
+                        )
     parser.add_argument('-ns', '--ngram_size',
                         type=int,
                         default=3,
                         help='ngrams of size ngram_size - 1 and ngram_size will be counted (default: 3)'
                         )
+    parser.add_argument('--morris_base',
+                        type=float,
+                        default=1.05,
+                        help='the base of the 8-bit log counters used by --morris (default: 1.05)'
+                        )
     parser.add_argument('-v', '--verbose',
                         help='increase verbosity',
                         action='store_const',
@@ -161,9 +283,16 @@ if __name__ == '__main__':
                        action='store_true',
                        help='use Count_Sketch (the default counter is Count_Min_Sketch)'
                        )
+    group.add_argument('--morris',
+                       action='store_true',
+                       help='use Count_Min_Sketch with 8-bit approximate counters'
+                       )
 
     args = parser.parse_args()
+    if (args.memory_budget is not None or args.target_error is not None) and \
+            (args.accurate or args.count_sketch or args.morris):
+        parser.error('--memory_budget and --target_error only size the default Count_Min_Sketch')
 
     logging.basicConfig(level=args.loglevel,
                         format='%(asctime)s: %(levelname)s: %(message)s')
-    main()
+    main(args)
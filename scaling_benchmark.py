@@ -0,0 +1,263 @@
+"""
+Measure how multiprocess_train.py scales with the number of processes.
+
+Strong scaling trains on the same corpus with 1, 2, 4, ... processes, weak scaling grows the
+corpus with the number of processes. The results are written as JSON so that they can be
+compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import logging
+import platform
+import subprocess
+import tempfile
+import numpy as np
+from multiprocessing import Process, Queue, cpu_count
+import multiprocess_train
+
+
+def replicate_corpus(corpus_path, num_lines, filepath):
+    """
+    Helper function for making a corpus of a given size by repeating the lines of another one.
+
+    corpus_path: str
+    num_lines: int
+    filepath: str
+        the location to write the corpus
+
+    Returns: None
+    """
+    with open(corpus_path, 'r', encoding='utf-8') as fin:
+        lines = [line for line in fin if line.strip()]
+
+    with open(filepath, 'w', encoding='utf-8') as fout:
+        fout.writelines(itertools.islice(itertools.cycle(lines), num_lines))
+
+
+def zipfian_corpus(num_lines, filepath, vocab_size=100000, exponent=1.1,
+                   line_length=1000, seed=0):
+    """
+    Helper function for generating a corpus whose word frequencies follow Zipf's law.
+
+    num_lines: int
+    filepath: str
+        the location to write the corpus
+    vocab_size: int
+    exponent: float
+        the frequency of the k-th most frequent word is proportional to k^-exponent
+    line_length: int
+        the number of words per line
+    seed: int
+
+    Returns: None
+    """
+    random_state = np.random.RandomState(seed)
+    probabilities = 1. / np.arange(1, vocab_size + 1) ** exponent
+    probabilities /= probabilities.sum()
+    words = np.array(['w%d' % i for i in range(vocab_size)])
+
+    with open(filepath, 'w', encoding='utf-8') as fout:
+        for _ in range(num_lines):
+            line = random_state.choice(words, size=line_length, p=probabilities)
+            fout.write(' '.join(line) + '\n')
+
+
+def make_corpus(num_lines, filepath):
+    if args.zipf:
+        zipfian_corpus(num_lines, filepath, vocab_size=args.vocab_size,
+                       exponent=args.exponent, line_length=args.line_length)
+    else:
+        replicate_corpus(args.corpus, num_lines, filepath)
+
+
+def git_commit():
+    """
+    Returns: str
+        the commit of the working tree, or None if it is not a git repository
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def train(train_args, results):
+    results.put(multiprocess_train.main(train_args))
+
+
+def train_in_subprocess(train_args):
+    """
+    Helper function for running multiprocess_train.main in a fresh process, so that its peak
+    memory is not the high-water mark of an earlier, larger run.
+
+    train_args: argparse.Namespace
+
+    Returns: dict
+        the stats returned by multiprocess_train.main
+    """
+    results = Queue()
+    p = Process(target=train, args=(train_args, results))
+    p.start()
+    stats = results.get()
+    p.join()
+    return stats
+
+
+def run(mode, process, num_lines, workdir):
+    """
+    Train a model on a corpus of num_lines lines with the given number of processes.
+
+    Returns: dict
+        wall time, per-phase time and peak memory of the run
+    """
+    corpus_path = os.path.join(workdir, 'corpus_%d.txt' % num_lines)
+    if not os.path.exists(corpus_path):
+        make_corpus(num_lines, corpus_path)
+
+    train_args = argparse.Namespace(
+        infile=corpus_path,
+        process=process,
+        output=os.path.join(workdir, 'model'),
+        encoding='utf-8',
+        hash_num=args.hash_num,
+        hash_size=args.hash_size,
+        ngram_size=args.ngram_size,
+        accurate=False,
+        count_sketch=False,
+        morris=False,
+        morris_base=1.05,
+        memory_budget=None,
+        target_error=None,
+    )
+
+    start = time.perf_counter()
+    stats = train_in_subprocess(train_args)
+    wall = time.perf_counter() - start
+
+    workers = stats.pop('workers')
+    phases = {k: stats[k] for k in ('read', 'feed', 'join', 'transfer', 'merge', 'save')}
+    for phase in ('wait', 'tokenize', 'count'):
+        phases[phase] = max(w[phase] for w in workers)
+
+    result = {
+        'mode': mode,
+        'process': process,
+        'lines': num_lines,
+        'wall': wall,
+        'phases': phases,
+        'peak_memory_growth': stats['peak_memory_growth'],
+        'workers': workers,
+    }
+    logging.info('%s scaling, %d processes, %d lines: %.2fs'
+                 % (mode, process, num_lines, wall))
+    return result
+
+
+def main():
+    processes = [1 << i for i in range(args.process.bit_length()) if 1 << i < args.process]
+    processes.append(args.process)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in ('strong', 'weak'):
+            for process in processes:
+                num_lines = args.lines * (process if mode == 'weak' else 1)
+                runs.append(run(mode, process, num_lines, workdir))
+
+    # strong: T1 / (p * Tp), weak: T1 / Tp
+    for mode in ('strong', 'weak'):
+        baseline = next(r['wall'] for r in runs if r['mode'] == mode and r['process'] == 1)
+        for r in runs:
+            if r['mode'] == mode:
+                r['speedup'] = baseline / r['wall'] * (r['process'] if mode == 'weak' else 1)
+                r['efficiency'] = r['speedup'] / r['process']
+
+    report = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': cpu_count(),
+        'config': vars(args),
+        'runs': runs,
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w', encoding='utf-8') as fout:
+            json.dump(report, fout, indent=2)
+        logging.info('report saved to %s' % args.output)
+
+    for r in runs:
+        logging.info('%-6s p = %-3d wall = %8.2fs  efficiency = %.2f'
+                     % (r['mode'], r['process'], r['wall'], r['efficiency']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-o', '--output',
+                        type=str,
+                        help='location to save the JSON report (default: stdout)'
+                        )
+    parser.add_argument('-p', '--process',
+                        type=int,
+                        default=cpu_count(),
+                        help='the largest number of processes to use (default: %d)' % cpu_count())
+    parser.add_argument('-l', '--lines',
+                        type=int,
+                        default=100,
+                        help='the number of lines of the corpus, per process for weak scaling (default: 100)'
+                        )
+    parser.add_argument('--corpus',
+                        type=str,
+                        default=os.path.join('corpus', 'tiny.txt'),
+                        help='the corpus whose lines are repeated (default: corpus/tiny.txt)'
+                        )
+    parser.add_argument('--zipf',
+                        action='store_true',
+                        help='generate a Zipfian corpus instead of repeating --corpus'
+                        )
+    parser.add_argument('--vocab_size',
+                        type=int,
+                        default=100000,
+                        help='the vocabulary size of the Zipfian corpus (default: 100000)'
+                        )
+    parser.add_argument('--exponent',
+                        type=float,
+                        default=1.1,
+                        help='the exponent of the Zipfian corpus (default: 1.1)'
+                        )
+    parser.add_argument('--line_length',
+                        type=int,
+                        default=1000,
+                        help='the number of words per line of the Zipfian corpus (default: 1000)'
+                        )
+    parser.add_argument('-hn', '--hash_num',
+                        type=int,
+                        default=32,
+                        help='the number of hash functions to use (default: 32)'
+                        )
+    parser.add_argument('-hs', '--hash_size',
+                        type=int,
+                        default=65536,
+                        help='the size of the hash values'
+                        )
+    parser.add_argument('-ns', '--ngram_size',
+                        type=int,
+                        default=3,
+                        help='ngrams of size ngram_size - 1 and ngram_size will be counted (default: 3)'
+                        )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s: %(levelname)s: %(message)s')
+
+    main()
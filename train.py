@@ -9,7 +9,12 @@ import os
 import argparse
 import pickle
 import logging
+import threading
+import queue
+import numpy as np
+from collections import Counter
 import frequency_estimation
+import cardinality_estimation
 
 PUNCS = ',.=[]{}/\\<>!@#$%^&*()-+_|`~"'
 
@@ -54,14 +59,31 @@ class CorpusReader(object):
         ngrams of size ngram_size and (ngram_size - 1) will be generated
     encoding: str, optional (default: utf-8)
         the encoding method of the corpus file
+    window_lines: int, optional
+        if given, the vocabulary only covers the last window_num * window_lines lines, in step
+        with frequency_estimation.WindowedCountMinSketch
+    window_num: int, optional
+        the number of blocks of window_lines lines kept in the vocabulary
     """
 
-    def __init__(self, corpus_path, ngram_size, encoding='utf-8'):
+    def __init__(self, corpus_path, ngram_size, encoding='utf-8', window_lines=None,
+                 window_num=None):
         self.corpus_path = corpus_path
         self.ngram_size = ngram_size
         self.encoding = encoding
+        self.window_lines = window_lines
+        self.window_num = window_num
         self.vocabulary = set()
+        self.window_vocabularies = []
         self.vocab_size = len(self.vocabulary)
+        self.lines = 0
+
+    def count_vocabulary(self):
+        """
+        Returns: int
+            the size of the vocabulary of the lines read so far (within the window)
+        """
+        return len(self.vocabulary.union(*self.window_vocabularies))
 
     def __iter__(self):
         """
@@ -80,6 +102,15 @@ class CorpusReader(object):
         ngram_size = self.ngram_size
         with open(self.corpus_path, 'r', encoding=self.encoding) as fin:
             for line in fin:
+                self.lines += 1
+
+                # the vocabulary of the oldest block of lines leaves the window
+                if self.window_lines and self.lines > 1 \
+                        and (self.lines - 1) % self.window_lines == 0:
+                    self.window_vocabularies.append(self.vocabulary)
+                    del self.window_vocabularies[:len(self.window_vocabularies) - self.window_num + 1]
+                    self.vocabulary = set()
+
                 # tokenize
                 words = tokenize(line, ngram_size)
 
@@ -95,7 +126,161 @@ class CorpusReader(object):
                     yield tuple(words[offset:offset + ngram_size])
                     yield tuple(words[offset:offset + ngram_size - 1])
 
+        self.vocab_size = self.count_vocabulary()
+
+
+class PipelinedTrainer(object):
+    """
+    Helper class for counting the ngrams of a corpus in batches. A reader thread reads blocks of
+    lines, a tokenizer thread turns every block into the counts of its distinct ngrams, and the
+    calling thread adds them to the counter with counter.process_batch, so every distinct ngram
+    is hashed once per block and the stages overlap wherever NumPy or file I/O releases the GIL.
+    Bounded queues keep at most 2 * queue_size blocks in memory. The final counts are the same as
+    processing the ngrams of CorpusReader one by one.
+
+    Parameters
+    ----------
+    counter: frequency_estimation.Sketch object
+        the counter to be updated
+    corpus_path: str
+        use the specified corpus to train the model
+    ngram_size: int
+        ngrams of size ngram_size and (ngram_size - 1) will be counted
+    encoding: str, optional (default: utf-8)
+        the encoding method of the corpus file
+    block_size: int, optional (default: 262144)
+        the approximate number of bytes of a block of lines
+    queue_size: int, optional (default: 4)
+        the number of blocks buffered between two stages
+    """
+
+    def __init__(self, counter, corpus_path, ngram_size, encoding='utf-8',
+                 block_size=262144, queue_size=4):
+        self.counter = counter
+        self.corpus_path = corpus_path
+        self.ngram_size = ngram_size
+        self.encoding = encoding
+        self.block_size = block_size
+        self.queue_size = queue_size
+        self.vocabulary = set()
+        self.vocab_size = len(self.vocabulary)
+        self.lines = 0
+        self.ngrams = 0
+
+    def train(self, callback=None):
+        """
+        Count all ngrams of the corpus.
+
+        callback: callable, optional
+            called with the trainer after every batch, e.g. for logging progress or saving
+            checkpoints
+
+        Returns: frequency_estimation.Sketch object
+            the updated counter
+        """
+        self._stop = threading.Event()
+        blocks = queue.Queue(self.queue_size)
+        batches = queue.Queue(self.queue_size)
+        stages = [
+            threading.Thread(target=self._read_blocks, args=(blocks,), daemon=True),
+            threading.Thread(target=self._tokenize_blocks, args=(blocks, batches), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+
+                num_lines, counts = batch
+                self.counter.process_batch(counts)
+                self.lines += num_lines
+                self.ngrams += sum(counts.values())
+                if callback is not None:
+                    callback(self)
+        finally:
+            # stop the stages even if the counter or the callback raised, otherwise they block
+            # on full queues forever and the reader keeps the corpus open
+            self._stop.set()
+            for stage in stages:
+                stage.join()
         self.vocab_size = len(self.vocabulary)
+        return self.counter
+
+    def _put(self, q, item):
+        """
+        Put item into the queue unless the trainer is stopped.
+
+        Returns: bool
+            whether the item was put
+        """
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        """
+        Get an item from the queue, or None once the trainer is stopped.
+        """
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _read_blocks(self, blocks):
+        """
+        Reader stage: put blocks of lines into the queue, followed by None.
+        """
+        try:
+            with open(self.corpus_path, 'r', encoding=self.encoding) as fin:
+                while True:
+                    lines = fin.readlines(self.block_size)
+                    if not lines:
+                        break
+                    if not self._put(blocks, lines):
+                        return
+            self._put(blocks, None)
+        except BaseException as e:
+            self._put(blocks, e)
+
+    def _tokenize_blocks(self, blocks, batches):
+        """
+        Tokenizer stage: turn every block of lines into (number of lines, ngram counts).
+        """
+        ngram_size = self.ngram_size
+        while True:
+            lines = self._get(blocks)
+            if lines is None or isinstance(lines, BaseException):
+                self._put(batches, lines)
+                return
+
+            try:
+                counts = Counter()
+                for line in lines:
+                    words = tokenize(line, ngram_size)
+                    self.vocabulary.update(words)
+                    if len(words) < ngram_size - 1:
+                        continue
+                    counts.update(zip(*(words[i:] for i in range(ngram_size))))
+                    # by offset rather than zip, which yields nothing for the empty history
+                    # of unigrams
+                    counts.update(tuple(words[offset:offset + ngram_size - 1])
+                                  for offset in range(0, len(words) - ngram_size + 1))
+                if not self._put(batches, (len(lines), counts)):
+                    return
+            except BaseException as e:
+                self._put(batches, e)
+                return
 
 
 def save_model(model, model_type, vocab_size, filepath, args):
@@ -122,10 +307,161 @@ def save_model(model, model_type, vocab_size, filepath, args):
             'hash_size': args.hash_size,
             'hash_num': args.hash_num,
             'ngram_size': args.ngram_size,
+            'sizing': args.sizing,
         }, fout)
 
 
+def sample_corpus(corpus_path, ngram_size, fraction, encoding='utf-8', chunks=100):
+    """
+    Helper function for estimating the total and distinct number of ngrams of a corpus by
+    scanning chunks spread evenly over the file and extrapolating to the file size.
+
+    corpus_path: str
+    ngram_size: int
+    fraction: float
+        the fraction of the corpus to scan
+    encoding: str, optional (default: utf-8)
+    chunks: int, optional (default: 100)
+        the number of places to sample from
+
+    Returns: (float, float)
+        the estimated total and distinct number of ngrams, the latter assumes every ngram
+        of the sample is new to the other samples so it is an upper bound
+    """
+    file_size = os.path.getsize(corpus_path)
+    chunk_size = max(1, int(file_size * fraction / chunks))
+    hll = cardinality_estimation.HyperLogLog(b=14)
+    total, sampled, position = 0, 0, 0
+
+    with open(corpus_path, 'rb') as fin:
+        for k in range(chunks):
+            offset = file_size * k // chunks
+            if offset > position:
+                # skip the partial line
+                fin.seek(offset - 1)
+                fin.readline()
+            start = fin.tell()
+            while fin.tell() - start < chunk_size:
+                line = fin.readline()
+                if not line:
+                    break
+                sampled += len(line)
+
+                words = tokenize(line.decode(encoding, errors='ignore'), ngram_size)
+                for i in range(0, len(words) - ngram_size + 1):
+                    hll.update(tuple(words[i:i + ngram_size]))
+                    hll.update(tuple(words[i:i + ngram_size - 1]))
+                    total += 2
+            position = fin.tell()
+
+    scale = file_size / max(sampled, 1)
+    return total * scale, hll.estimate() * scale
+
+
+def choose_sketch_size(total, distinct, memory_budget=None, target_error=None, delta=0.001):
+    """
+    Helper function for sizing a Count-Min Sketch. With width w and depth d, a query
+    overestimates by more than e / w * total with probability at most exp(-d).
+
+    total: float
+        the total number of ngrams to be counted
+    distinct: float
+        the number of distinct ngrams, without a target error the width will not be much
+        larger than that
+    memory_budget: int, optional
+        the memory available for the counters, in bytes
+    target_error: float, optional
+        the largest acceptable overestimate of a count
+    delta: float, optional (default: 0.001)
+        the probability that a query misses the target error
+
+    Returns: dict
+        hash_size (a power of 2 so that the model can be folded), hash_num, dtype, the
+        predicted error and which of distinct / target_error / memory_budget limited hash_size
+    """
+    hash_num = int(np.ceil(np.log(1 / delta)))
+    # total is extrapolated from a sample, so never go below uint32
+    dtype = next(t for t in (np.uint32, np.uint64)
+                 if np.iinfo(t).max > 2 * total)
+    itemsize = np.dtype(dtype).itemsize
+
+    # the bound only depends on the width, so a target error overrides the distinct cap
+    if target_error is not None:
+        limits = [('target_error', 1 << int(np.ceil(np.e * total / target_error)).bit_length())]
+    else:
+        limits = [('distinct', 1 << int(np.ceil(2 * distinct)).bit_length())]
+    if memory_budget is not None:
+        max_size = memory_budget // (hash_num * itemsize)
+        if max_size < 1:
+            raise ValueError('memory budget of %d bytes is too small for %d hash functions'
+                             % (memory_budget, hash_num))
+        limits.append(('memory_budget', 1 << (int(max_size).bit_length() - 1)))
+    limit, hash_size = min(limits, key=lambda l: l[1])
+
+    return {
+        'hash_size': hash_size,
+        'hash_num': hash_num,
+        'dtype': np.dtype(dtype).name,
+        'total': float(total),
+        'distinct': float(distinct),
+        'predicted_error': float(np.e * total / hash_size),
+        'delta': float(np.exp(-hash_num)),
+        'limit': limit,
+    }
+
+
+def auto_size(args):
+    """
+    Helper function for running the sampling pre-pass and sizing the sketch, the chosen sizes
+    replace args.hash_size and args.hash_num and are stored in args.sizing.
+
+    args: argparse.Namespace
+
+    Returns: None
+    """
+    total, distinct = sample_corpus(args.infile, args.ngram_size, args.sample_fraction,
+                                    encoding=args.encoding)
+    memory_budget = None
+    if args.memory_budget is not None:
+        memory_budget = int(args.memory_budget * 1024 * 1024)
+    sizing = choose_sketch_size(total, distinct, memory_budget=memory_budget,
+                                target_error=args.target_error, delta=args.delta)
+
+    logging.info('estimated %d ngrams, %d distinct' % (total, distinct))
+    logging.info('hash_size = %d (limited by %s), hash_num = %d, dtype = %s, '
+                 'predicted error <= %.2f w.p. %g'
+                 % (sizing['hash_size'], sizing['limit'], sizing['hash_num'], sizing['dtype'],
+                    sizing['predicted_error'], sizing['delta']))
+    if args.target_error is not None and sizing['predicted_error'] > args.target_error:
+        logging.warning('predicted error %.2f exceeds target error %g, hash_size is limited by %s'
+                        % (sizing['predicted_error'], args.target_error, sizing['limit']))
+
+    args.hash_size = sizing['hash_size']
+    args.hash_num = sizing['hash_num']
+    args.sizing = sizing
+
+
+def check_overflow(counter, total):
+    """
+    Helper function for detecting counters of a sized Count-Min Sketch that wrapped around,
+    every row adds up to the number of counted ngrams unless one did.
+
+    counter: frequency_estimation.CountMinSketch object
+    total: int
+        the number of ngrams counted
+
+    Returns: None
+    """
+    if int(counter.counters[0].sum(dtype=np.uint64)) != total:
+        raise OverflowError('%s counters overflowed after %d ngrams, retry with a larger '
+                            '--sample_fraction' % (counter.counters.dtype, total))
+
+
 def main():
+    args.sizing = None
+    if args.memory_budget is not None or args.target_error is not None:
+        auto_size(args)
+
     # choose the counting method base on args
     if args.accurate:
         counter = frequency_estimation.Simple()
@@ -134,23 +470,67 @@ def main():
         counter = frequency_estimation.CountSketch(
             hash_num=args.hash_num, hash_size=args.hash_size)
         model_type = 'count_sketch'
+    elif args.morris:
+        counter = frequency_estimation.MorrisCountMinSketch(
+            hash_num=args.hash_num, hash_size=args.hash_size, base=args.morris_base)
+        model_type = 'morris_count_min_sketch'
+    elif args.window_num:
+        counter = frequency_estimation.WindowedCountMinSketch(
+            hash_num=args.hash_num, hash_size=args.hash_size, window_num=args.window_num)
+        model_type = 'windowed_count_min_sketch'
     else:
         counter = frequency_estimation.CountMinSketch(
-            hash_num=args.hash_num, hash_size=args.hash_size)
+            hash_num=args.hash_num, hash_size=args.hash_size,
+            dtype=args.sizing['dtype'] if args.sizing else int)
         model_type = 'count_min_sketch'
 
+    if args.pipeline:
+        trainer = PipelinedTrainer(counter, args.infile, ngram_size=args.ngram_size,
+                                   encoding=args.encoding, block_size=args.block_size)
+        checkpoint = [1000000]
+
+        def save_checkpoint(trainer):
+            logging.debug('processed %d lines' % trainer.lines)
+            if trainer.ngrams >= checkpoint[0]:
+                logging.info('processed %d ngrams' % trainer.ngrams)
+                save_model(counter, model_type, len(
+                    trainer.vocabulary), args.output, args)
+                checkpoint[0] = (trainer.ngrams // 1000000 + 1) * 1000000
+
+        trainer.train(callback=save_checkpoint)
+        if args.sizing:
+            check_overflow(counter, trainer.ngrams)
+
+        # save the model for future evaluation
+        save_model(counter, model_type, trainer.vocab_size, args.output, args)
+        logging.info('model saved to %s' % args.output)
+        return
+
     # load the input corpus
     reader = CorpusReader(
-        args.infile, ngram_size=args.ngram_size, encoding=args.encoding)
+        args.infile, ngram_size=args.ngram_size, encoding=args.encoding,
+        window_lines=args.window_lines if args.window_num else None,
+        window_num=args.window_num)
 
+    epoch = 0
+    i = -1
     for i, ngram in enumerate(reader):
-        logging.debug('processing %s' % str(ngram))
+        # expire the oldest sub-sketch every window_lines lines
+        if args.window_num:
+            while (reader.lines - 1) // args.window_lines > epoch:
+                counter.rotate()
+                epoch += 1
+
+        logging.debug('processing %s', ngram)
         counter.process(ngram)
 
         if (i + 1) % 1000000 == 0:
             logging.info('processed %d ngrams' % (i + 1))
-            save_model(counter, model_type, len(
-                reader.vocabulary), args.output, args)
+            save_model(counter, model_type, reader.count_vocabulary(),
+                       args.output, args)
+
+    if args.sizing:
+        check_overflow(counter, i + 1)
 
     # save the model for future evaluation
     save_model(counter, model_type, reader.vocab_size, args.output, args)
@@ -183,11 +563,48 @@ if __name__ == '__main__':
                         default=65536,
                         help='the size of the hash values'
                         )
+    parser.add_argument('-m', '--memory_budget',
+                        type=float,
+                        help='choose hash_size, hash_num and the counter type to fit the sketch in the given memory (in MiB)'
+                        )
+    parser.add_argument('-e', '--target_error',
+                        type=float,
+                        help='choose hash_size, hash_num and the counter type to keep the overestimate of a count under the given error'
+                        )
+    parser.add_argument('--delta',
+                        type=float,
+                        default=0.001,
+                        help='the probability that a count misses the target error under --memory_budget or --target_error (default: 0.001)'
+                        )
+    parser.add_argument('--sample_fraction',
+                        type=float,
+                        default=0.01,
+                        help='the fraction of the corpus scanned to size the sketch (default: 0.01)'
+                        )
     parser.add_argument('-ns', '--ngram_size',
                         type=int,
                         default=3,
                         help='ngrams of size ngram_size - 1 and ngram_size will be counted (default: 3)'
                         )
+    parser.add_argument('--pipeline',
+                        action='store_true',
+                        help='count ngrams in batches with overlapped read, tokenize and count stages'
+                        )
+    parser.add_argument('--block_size',
+                        type=int,
+                        default=262144,
+                        help='the number of bytes read per batch by --pipeline (default: 262144)'
+                        )
+    parser.add_argument('--window_lines',
+                        type=int,
+                        default=100000,
+                        help='the number of lines counted by each sub-sketch of a windowed model (default: 100000)'
+                        )
+    parser.add_argument('--morris_base',
+                        type=float,
+                        default=1.05,
+                        help='the base of the 8-bit log counters used by --morris (default: 1.05)'
+                        )
     parser.add_argument('-v', '--verbose',
                         help='increase verbosity',
                         action='store_const',
@@ -213,8 +630,21 @@ if __name__ == '__main__':
                        action='store_true',
                        help='use Count_Sketch (the default counter is Count_Min_Sketch)'
                        )
+    group.add_argument('--morris',
+                       action='store_true',
+                       help='use Count_Min_Sketch with 8-bit approximate counters'
+                       )
+    group.add_argument('--window_num',
+                       type=int,
+                       help='use Count_Min_Sketch over a sliding window of window_num * window_lines lines'
+                       )
 
     args = parser.parse_args()
+    if (args.memory_budget is not None or args.target_error is not None) and \
+            (args.accurate or args.count_sketch or args.morris or args.window_num):
+        parser.error('--memory_budget and --target_error only size the default Count_Min_Sketch')
+    if args.pipeline and args.window_num:
+        parser.error('--pipeline cannot rotate windows within a batch, use it without --window_num')
 
     logging.basicConfig(level=args.loglevel,
                         format='%(asctime)s: %(levelname)s: %(message)s')